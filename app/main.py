@@ -1,14 +1,37 @@
 from io import FileIO, BytesIO
 import os
-import zlib
+import stat
+import sys
+import time
 import click
+from concurrent.futures import ProcessPoolExecutor
 import hashlib
 import itertools
-from datetime import datetime
+import mmap
 import requests
 import re
 from urllib.parse import urlparse
 
+try:
+    from isal import isal_zlib as zlib
+except ImportError:
+    import zlib
+
+_PKT_RE = re.compile(rb"^[0-9a-f]{4}#")
+_SYMREF_RE = re.compile(rb"symref=HEAD:(?P<ref>[^ ]*)")
+
+_HEAD = {"blob": b"blob ", "tree": b"tree ", "commit": b"commit ", "tag": b"tag "}
+
+_AUTHOR = b"author cndoit18 <cndoit18@outlook.com> %d %s%02d%02d\n"
+
+# write-tree hashes fewer blobs than this in-process
+_POOL_MIN_FILES = 512
+
+# .git/objects/xx folders this process has already made sure exist
+_object_dirs = set()
+# cleared once O_TMPFILE + link turns out not to work here
+_use_tmpfile = True
+
 
 @click.group()
 def git():
@@ -33,63 +56,173 @@ def hash_object(w: bool, obj: FileIO):
 
 
 def _hash_object(w, obj, typ):
-    m = hashlib.sha1()
-    content = obj.read()
-    blob = f"{typ} {len(content)}\0".encode("utf-8") + content
-    m.update(blob)
-    p = m.hexdigest()
+    size = _file_size(obj)
+    if typ == "blob" and not w and size is not None:
+        # nothing to compress, let hashlib feed the hasher from the file itself
+        header = _HEAD[typ] + str(size).encode() + b"\0"
+        return hashlib.file_digest(
+            obj, lambda: hashlib.sha1(header, usedforsecurity=False)
+        ).hexdigest()
+
+    return _hash_object_raw(obj.read(), typ, w).hex()
+
+
+def _hash_object_raw(content, typ, w=True) -> bytes:
+    # content may be any buffer (e.g. an mmap), so hash and compress the
+    # header and the content separately instead of concatenating them
+    header = _HEAD[typ] + str(len(content)).encode() + b"\0"
+    m = hashlib.sha1(header, usedforsecurity=False)
+    m.update(content)
+    binhash = m.digest()
     if w:
+        p = binhash.hex()
         path = f".git/objects/{p[0:2]}/{p[2:]}"
         folder = os.path.dirname(path)
-        if not os.path.exists(folder):
-            os.makedirs(folder)
-        with open(path, "wb") as f:
-            f.write(zlib.compress(blob))
-    return p
+        if folder not in _object_dirs:
+            os.makedirs(folder, exist_ok=True)
+            _object_dirs.add(folder)
+        c = zlib.compressobj(1)
+        _write_loose_object(
+            folder, path, [c.compress(header), c.compress(content), c.flush()]
+        )
+    return binhash
+
+
+def _write_loose_object(folder, path, chunks):
+    # write into an anonymous file in the object folder and link it into
+    # place once complete, so readers never see a half written object
+    global _use_tmpfile
+    fd = None
+    if _use_tmpfile:
+        try:
+            fd = os.open(folder, os.O_TMPFILE | os.O_WRONLY, 0o444)
+        except (AttributeError, OSError):
+            _use_tmpfile = False  # no O_TMPFILE on this platform or filesystem
+    if fd is not None:
+        try:
+            _write_all(fd, chunks)
+            try:
+                os.link(f"/proc/self/fd/{fd}", path)
+                return
+            except FileExistsError:
+                return  # objects are content-addressed, the existing one is identical
+            except OSError:
+                _use_tmpfile = False  # no /proc to link through, or it is refused
+        finally:
+            os.close(fd)
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o444)
+    except FileExistsError:
+        return
+    try:
+        _write_all(fd, chunks)
+    finally:
+        os.close(fd)
+
+
+def _write_all(fd, chunks):
+    # one writev for the whole object, finishing any short write by hand
+    n = os.writev(fd, chunks)
+    for chunk in chunks:
+        if n >= len(chunk):
+            n -= len(chunk)
+            continue
+        view = memoryview(chunk)[n:]
+        while view:
+            view = view[os.write(fd, view) :]
+        n = 0
+
+
+def _hash_file(path) -> bytes:
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return _hash_object_raw(b"", "blob")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            return _hash_object_raw(m, "blob")
+
+
+def _file_size(obj):
+    try:
+        st = os.fstat(obj.fileno())
+    except (AttributeError, OSError):
+        return None
+    if not stat.S_ISREG(st.st_mode):
+        return None
+    return st.st_size - obj.tell()
+
+
+def _iter_inflate(path, chunk=65536):
+    d = zlib.decompressobj()
+    with open(path, "rb") as f:
+        while buf := f.read(chunk):
+            yield d.decompress(buf)
+    yield d.flush()
+
+
+def _open_object(sha):
+    chunks = _iter_inflate(f".git/objects/{sha[0:2]}/{sha[2:]}")
+    head = b""
+    for chunk in chunks:
+        head += chunk
+        if b"\0" in head:
+            break
+    head, rest = head.split(b"\0", 1)
+    typ, size = head.split(b" ")
+    return typ.decode("utf-8"), int(size), itertools.chain([rest], chunks)
+
+
+def _read_object(sha):
+    typ, size, chunks = _open_object(sha)
+    content = b"".join(chunks)
+    assert len(content) == size
+    return typ, content
+
+
+def _copy_object(sha, out):
+    _, size, chunks = _open_object(sha)
+    written = 0
+    for chunk in chunks:
+        written += out.write(chunk)
+    assert written == size
 
 
 @git.command(name="cat-file")
 @click.option("-p", type=str, help="pretty-print <object> content")
 def cat_file(p: str):
     if p:
-        with open(f".git/objects/{p[0:2]}/{p[2:]}", "rb") as f:
-            raw = zlib.decompress(f.read())
-            head, content = raw.split(b"\0", 1)
-            _, size = head.split(b" ")
-            assert len(content) == int(size)
-            print(content.decode("utf-8"), end="")
+        _copy_object(p, sys.stdout.buffer)
 
 
 @git.command(name="ls-tree")
 @click.argument("tree_ish", type=str)
 @click.option("--name-only", is_flag=True, help="list only filenames")
 def ls_tree(tree_ish: str, name_only: bool):
-    with open(f".git/objects/{tree_ish[0:2]}/{tree_ish[2:]}", "rb") as f:
-        raw = zlib.decompress(f.read())
-        head, content = raw.split(b"\0", 1)
-        assert head.startswith(b"tree")
-        _, size = head.split(b" ")
-        assert len(content) == int(size)
-        objects = []
-        while True:
-            pos = content.find(b"\x00")
-            if pos == -1:
-                break
-            x, sha1 = content[: pos + 21].split(b"\x00", 1)
-            mode, name = x.split(b" ")
-            objects.append([mode, name, sha1])
-            content = content[pos + 21 :]
-        for o in objects:
-            if name_only:
-                print(o[1].decode("utf-8"))
-            else:
-                print(
-                    "{:0>6} {:040x}     {}".format(
-                        o[0].decode("utf-8"),
-                        int.from_bytes(o[2], "big"),
-                        o[1].decode("utf-8"),
-                    )
+    typ, content = _read_object(tree_ish)
+    assert typ == "tree"
+    for o in _parse_tree(content):
+        if name_only:
+            print(o[1].decode("utf-8"))
+        else:
+            print(
+                "{:0>6} {}     {}".format(
+                    o[0].decode("utf-8"),
+                    o[2].hex(),
+                    o[1].decode("utf-8"),
                 )
+            )
+
+
+def _parse_tree(content):
+    # entries are "<mode> <name>\0<20-byte sha>", sliced straight out of content
+    objects = []
+    i = 0
+    n = len(content)
+    while i < n:
+        j = content.index(b" ", i)
+        k = content.index(b"\x00", j)
+        objects.append((content[i:j], content[j + 1 : k], content[k + 1 : k + 21]))
+        i = k + 21
+    return objects
 
 
 @git.command(name="write-tree")
@@ -98,43 +231,56 @@ def write_tree():
 
 
 def _write_tree(top=r".") -> str:
-    files_hash = []
-    for file in os.listdir(top):
-        if file == ".git":
+    # post-order walk with an explicit stack of (entries, dir_name, files_hash);
+    # blob entries are hashed in one batch once the walk is done
+    trees = []
+    blobs = []
+    paths = []
+    stack = [(os.scandir(top), None, [])]
+    while stack:
+        entries, dir_name, files_hash = stack[-1]
+        entry = next(entries, None)
+        if entry is None:
+            entries.close()
+            stack.pop()
+            trees.append((files_hash, stack[-1][2] if stack else None, dir_name))
             continue
 
-        path = os.path.join(top, file)
-        if os.path.isfile(path):
-            with open(path, "rb") as f:
-                files_hash.append(
-                    [
-                        "100644",
-                        os.path.relpath(path, start=top),
-                        int(_hash_object(True, f, "blob"), base=16).to_bytes(
-                            length=20,
-                            byteorder="big",
-                        ),
-                    ]
-                )
-        elif os.path.isdir(os.path.join(top, file)):
-            files_hash.append(
-                [
-                    "40000",
-                    os.path.relpath(path, start=top),
-                    int(
-                        _write_tree(path),
-                        base=16,
-                    ).to_bytes(
-                        length=20,
-                        byteorder="big",
-                    ),
-                ]
-            )
-    files_hash.sort(key=lambda x: x[1])
-    tree_blob = b"".join(
-        f"{mode} {name}\0".encode("utf-8") + hash for mode, name, hash in files_hash
-    )
-    return _hash_object(True, BytesIO(tree_blob), "tree")
+        if entry.name == ".git":
+            continue
+
+        if entry.is_file():
+            blob = ["100644", entry.name, None]
+            files_hash.append(blob)
+            blobs.append(blob)
+            paths.append(entry.path)
+        elif entry.is_dir(follow_symlinks=False):
+            stack.append((os.scandir(entry.path), entry.name, []))
+
+    for blob, binhash in zip(blobs, _hash_files(paths)):
+        blob[2] = binhash
+
+    # trees are in post-order, so every subtree is hashed before its parent
+    for files_hash, parent, dir_name in trees:
+        files_hash.sort(key=lambda x: x[1])
+        tree_blob = b"".join(
+            f"{mode} {name}\0".encode("utf-8") + hash for mode, name, hash in files_hash
+        )
+        binhash = _hash_object_raw(tree_blob, "tree")
+        if parent is None:
+            return binhash.hex()
+        parent.append(["40000", dir_name, binhash])
+
+
+def _hash_files(paths):
+    # a process pool only pays for its startup and per-task pickling once
+    # there are enough blobs to spread over more than one CPU
+    workers = min(32, os.cpu_count() or 1)
+    if workers == 1 or len(paths) < _POOL_MIN_FILES:
+        return [_hash_file(path) for path in paths]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        chunksize = -(-len(paths) // (workers * 4))
+        return list(pool.map(_hash_file, paths, chunksize=chunksize))
 
 
 @git.command(name="commit-tree")
@@ -142,12 +288,16 @@ def _write_tree(top=r".") -> str:
 @click.option("-p", type=str, help="id of a parent commit object")
 @click.option("-m", type=str, help="commit message")
 def commit_tree(tree_ish: str, p: str, m: str):
-    now = datetime.now().astimezone()
+    ts = int(time.time())
+    off = time.localtime(ts).tm_gmtoff
     commit = f"tree {tree_ish} \n".encode("utf-8")
     if p:
         commit += f"parent {p} \n".encode("utf-8")
-    commit += f"author cndoit18 <cndoit18@outlook.com> {int(now.timestamp())} {now.strftime('%z')}\n".encode(
-        "utf-8"
+    commit += _AUTHOR % (
+        ts,
+        b"-" if off < 0 else b"+",
+        abs(off) // 3600,
+        abs(off) // 60 % 60,
     )
     commit += b"\n"
     if m:
@@ -163,213 +313,232 @@ def clone(url: str, target: str):
     if not target:
         target = remote.path.split("/")[2]
 
-    resp = requests.get(
-        f"https://{remote.netloc}{remote.path}/info/refs?service=git-upload-pack",
-        headers={
-            "content-type": "application/x-git-upload-pack-request",
-        },
-    )
-    assert resp.status_code == 200
-
-    if not re.match(r"^[0-9a-f]{4}#", resp.text):
-        click.echo("response format error")
-    smart = resp.text
-    cur = 0
-    offset = int(smart[cur : cur + 4], base=16)
-
-    # skip header
-    cur += offset
-
-    assert "0000" == smart[cur : cur + 4]
-    cur += 4
+    # info/refs and every git-upload-pack POST share one keep-alive connection
+    with requests.Session() as session:
+        session.headers.update(
+            {
+                "content-type": "application/x-git-upload-pack-request",
+                "user-agent": "git/2.47.0",
+            }
+        )
+        resp = session.get(
+            f"https://{remote.netloc}{remote.path}/info/refs?service=git-upload-pack",
+        )
+        assert resp.status_code == 200
 
-    offset = int(smart[cur : cur + 4], base=16)
+        smart = resp.content
+        if not _PKT_RE.match(smart):
+            click.echo("response format error")
+        cur = 0
+        offset = int(smart[cur : cur + 4], base=16)
 
-    if not os.path.exists(target):
-        os.mkdir(target)
-    os.chdir(target)
-    os.mkdir(".git")
-    os.mkdir(".git/objects")
-    os.mkdir(".git/refs")
-    ref = re.findall(r"symref=HEAD:(?P<ref>[^ ]*)", smart[cur + 4 : offset])
-    hd, _ = smart[cur + 4 : offset].split(" ", 1)
-    if ref:
-        with open(".git/HEAD", "w") as f:
-            f.write(f"ref: {ref[0]}")
+        # skip header
+        cur += offset
 
-    # skip metadata
-    cur += offset
+        assert b"0000" == smart[cur : cur + 4]
+        cur += 4
 
-    wants = []
-    while cur < len(smart):
         offset = int(smart[cur : cur + 4], base=16)
-        if offset == 0:
-            break
-        sha, ref = smart[cur + 4 : cur + offset - 1].split(" ")
-        wants.append([sha, ref])
+
+        if not os.path.exists(target):
+            os.mkdir(target)
+        os.chdir(target)
+        os.mkdir(".git")
+        os.mkdir(".git/objects")
+        os.mkdir(".git/refs")
+        line = smart[cur + 4 : cur + offset - 1]
+        ref = _SYMREF_RE.findall(line)
+        hd = line.split(b" ", 1)[0].decode("utf-8")
+        if ref:
+            with open(".git/HEAD", "w") as f:
+                f.write(f"ref: {ref[0].decode('utf-8')}")
+
+        # skip metadata
         cur += offset
 
-    for sha, ref in wants:
-        ref = os.path.join(".git", ref)
-        os.mkdir(os.path.dirname(ref))
-        with open(ref, "w") as f:
-            f.write(sha)
-        data = f"0032want {sha}\n00000009done\n"
-        resp = requests.post(
-            f"https://{remote.netloc}{remote.path}/git-upload-pack",
-            headers={
-                "content-type": "application/x-git-upload-pack-request",
-            },
-            data=data,
-        )
-        assert resp.status_code == 200
-        nak, packfile = resp.content.split(b"\n", 1)
-        assert nak[4:] == b"NAK"
-        assert packfile[-20:] == hashlib.sha1(packfile[:-20]).digest()
-        cur = 0
-        assert packfile[cur : cur + 4] == b"PACK"
-        cur += 4
-        assert int.from_bytes(packfile[cur : cur + 4], "big") == 2
-        cur += 4
-        obj_len = int.from_bytes(packfile[cur : cur + 4])
-        cur += 4
-        pack = packfile[cur:]
-
-        deltas = []
-        for _ in range(obj_len):
-            byte = pack[0]
-            obj_type = (byte >> 4) & 0x07
-            size = byte & 0x0F
-            shift = 4
-            pack = pack[1:]
-            while byte & 0x80 and len(pack) > 0:
-                byte = pack[0]
-                size |= (byte & 0x7F) << shift
-                shift += 7
-                pack = pack[1:]
-            decompressor = zlib.decompressobj()
-            if obj_type in {1: "commit", 2: "tree", 3: "blob"}:
-                raw = decompressor.decompress(pack, max_length=size)
-                decompressor.flush()
-                assert len(raw) == size
-                _hash_object(
-                    True,
-                    BytesIO(raw),
-                    {1: "commit", 2: "tree", 3: "blob"}[obj_type],
-                )
-            else:
-                delta_name, pack = pack[0:20], pack[20:]
-                raw = decompressor.decompress(pack, max_length=size)
-                decompressor.flush()
-                assert len(raw) == size
-                deltas.append(
-                    (
-                        delta_name.hex(),
-                        raw,
+        wants = []
+        while cur < len(smart):
+            offset = int(smart[cur : cur + 4], base=16)
+            if offset == 0:
+                break
+            sha, ref = smart[cur + 4 : cur + offset - 1].decode("utf-8").split(" ")
+            wants.append([sha, ref])
+            cur += offset
+
+        for sha, ref in wants:
+            ref = os.path.join(".git", ref)
+            os.mkdir(os.path.dirname(ref))
+            with open(ref, "w") as f:
+                f.write(sha)
+            data = f"0032want {sha}\n00000009done\n"
+            resp = session.post(
+                f"https://{remote.netloc}{remote.path}/git-upload-pack",
+                data=data,
+                stream=True,
+            )
+            assert resp.status_code == 200
+            # hash the pack as it arrives, always holding back the last 20 bytes
+            # since they may turn out to be the trailer
+            packfile = bytearray()
+            h = hashlib.sha1(usedforsecurity=False)
+            cur = hashed = None
+            for chunk in resp.iter_content(65536):
+                packfile.extend(chunk)
+                if cur is None:
+                    nl = packfile.find(b"\n")
+                    if nl == -1:
+                        continue
+                    cur = hashed = nl + 1
+                end = len(packfile) - 20
+                if end > hashed:
+                    with memoryview(packfile) as mv:
+                        h.update(mv[hashed:end])
+                    hashed = end
+            assert cur is not None
+            assert packfile[4 : cur - 1] == b"NAK"
+            assert packfile[-20:] == h.digest()
+            pack = memoryview(packfile)
+            assert pack[cur : cur + 4] == b"PACK"
+            cur += 4
+            assert int.from_bytes(pack[cur : cur + 4], "big") == 2
+            cur += 4
+            obj_len = int.from_bytes(pack[cur : cur + 4])
+            cur += 4
+
+            deltas = []
+            for _ in range(obj_len):
+                obj_type, size, cur = process_pack_header(pack, cur)
+                if obj_type in {1: "commit", 2: "tree", 3: "blob"}:
+                    raw, cur = process_pack_object(pack, cur, size)
+                    _hash_object_raw(raw, {1: "commit", 2: "tree", 3: "blob"}[obj_type])
+                else:
+                    delta_name = pack[cur : cur + 20].hex()
+                    raw, cur = process_pack_object(pack, cur + 20, size)
+                    deltas.append(
+                        (
+                            delta_name,
+                            raw,
+                        )
                     )
-                )
 
-            pack = decompressor.unused_data
-
-        for delta in deltas:
-            raw = delta[1]
-            sha = delta[0]
-
-            source_size, raw = process_var_int(raw)
-            target_size, raw = process_var_int(raw)
-            target_content = b""
-
-            with open(f".git/objects/{sha[0:2]}/{sha[2:]}", "rb") as f:
-                original = zlib.decompress(f.read())
-                head, content = original.split(b"\0", 1)
-                typ, si = head.split(b" ")
-                assert len(content) == int(si)
-                assert source_size == int(si)
-
-            while raw:
-                byte = raw[0]
-                raw = raw[1:]
-                if byte & 0x80:  # copy
-                    offset = 0
-                    size = 0
-                    shift = 0
-                    offset_bits = byte & 0xF
-                    while offset_bits:
-                        if offset_bits & 1:
-                            offset |= raw[0] << shift
-                            raw = raw[1:]
-                        shift += 8
-                        offset_bits = offset_bits >> 1
-                    shift = 0
-                    size_bits = (byte >> 4) & 0x7
-                    while size_bits:
-                        if size_bits & 1:
-                            size |= raw[0] << shift
-                            raw = raw[1:]
-                        shift += 8
-                        size_bits = size_bits >> 1
-                    size = size or 0x1000
-                    assert offset + size <= source_size
-                    target_content += content[offset : offset + size]
-                else:  # insert
-                    size = byte & 0x7F
-                    data, raw = raw[:size], raw[size:]
-                    assert len(data) == size
-                    target_content += data
-            assert len(target_content) == target_size
-            _hash_object(True, BytesIO(target_content), typ)
+            for delta in deltas:
+                raw = delta[1]
+                sha = delta[0]
+
+                mv = memoryview(raw)
+                source_size, cur = process_var_int(mv, 0)
+                target_size, cur = process_var_int(mv, cur)
+
+                typ, content = _read_object(sha)
+                assert source_size == len(content)
+                base = memoryview(content)
+
+                out = bytearray(target_size)
+                w = 0
+                while cur < len(mv):
+                    byte = mv[cur]
+                    cur += 1
+                    if byte & 0x80:  # copy
+                        offset = 0
+                        size = 0
+                        shift = 0
+                        offset_bits = byte & 0xF
+                        while offset_bits:
+                            if offset_bits & 1:
+                                offset |= mv[cur] << shift
+                                cur += 1
+                            shift += 8
+                            offset_bits = offset_bits >> 1
+                        shift = 0
+                        size_bits = (byte >> 4) & 0x7
+                        while size_bits:
+                            if size_bits & 1:
+                                size |= mv[cur] << shift
+                                cur += 1
+                            shift += 8
+                            size_bits = size_bits >> 1
+                        size = size or 0x10000
+                        assert offset + size <= source_size
+                        out[w : w + size] = base[offset : offset + size]
+                        w += size
+                    else:  # insert
+                        size = byte & 0x7F
+                        assert cur + size <= len(mv)
+                        out[w : w + size] = mv[cur : cur + size]
+                        w += size
+                        cur += size
+                assert w == target_size
+                _hash_object_raw(out, typ)
 
     # init workspace
-    with open(f".git/objects/{hd[0:2]}/{hd[2:]}", "rb") as f:
-        raw = zlib.decompress(f.read())
-        index = raw.find(b"tree ")
-        tree_ish = raw[index + 5 : index + 45]
-        _write_workspace(tree_ish.decode("utf-8"))
+    typ, content = _read_object(hd)
+    assert typ == "commit"
+    index = content.index(b"tree ") + 5
+    _write_workspace(content[index : index + 40].decode("utf-8"))
 
 
 def _write_workspace(tree_ish, top="."):
-    with open(f".git/objects/{tree_ish[:2]}/{tree_ish[2:]}", "rb") as f:
-        raw = zlib.decompress(f.read())
-        head, content = raw.split(b"\0", 1)
-        assert head.startswith(b"tree")
-        _, size = head.split(b" ")
-        assert len(content) == int(size)
-        while True:
-            pos = content.find(b"\x00")
-            if pos == -1:
-                break
-            x, sha1 = content[: pos + 21].split(b"\x00", 1)
-            mode, name = x.split(b" ")
-            content = content[pos + 21 :]
+    stack = [(tree_ish, top)]
+    while stack:
+        tree_ish, top = stack.pop()
+        typ, content = _read_object(tree_ish)
+        assert typ == "tree"
+        for mode, name, sha1 in _parse_tree(content):
             sha1 = sha1.hex()
             path = os.path.join(top, name.decode("utf-8"))
             mode = int(mode, 8)
             if mode & 0x4000:
                 if not os.path.exists(path):
                     os.mkdir(path)
-                _write_workspace(sha1, top=path)
+                stack.append((sha1, path))
             else:
-                with open(f".git/objects/{sha1[0:2]}/{sha1[2:]}", "rb") as f:
-                    raw = zlib.decompress(f.read())
-                    head, cc = raw.split(b"\0", 1)
-                    _, size = head.split(b" ")
-                    assert len(cc) == int(size)
-                with open(path, "w") as f:
-                    f.write(cc.decode())
+                with open(path, "wb") as f:
+                    _copy_object(sha1, f)
                 os.chmod(path, mode & 0x1FF)
-                continue
 
 
-def process_var_int(raw):
+def process_var_int(buf, pos):
     shift = 0
     var = 0
-    while raw[0] & 0x80:
-        c, raw = raw[0], raw[1:]
+    while True:
+        c = buf[pos]
+        pos += 1
         var |= (c & 0x7F) << shift
+        if not c & 0x80:
+            return var, pos
+        shift += 7
+
+
+def process_pack_header(buf, pos):
+    c = buf[pos]
+    pos += 1
+    obj_type = (c >> 4) & 0x07
+    size = c & 0x0F
+    shift = 4
+    while c & 0x80:
+        c = buf[pos]
+        pos += 1
+        size |= (c & 0x7F) << shift
         shift += 7
-    c, raw = raw[0], raw[1:]
-    var += (c & 0x7F) << shift
-    return var, raw
+    return obj_type, size, pos
+
+
+def process_pack_object(buf, pos, size):
+    # the deflated length is not stored, so feed the decompressor bounded
+    # windows and give back what it did not use; starting with a window just
+    # above the inflated size keeps unused_data from copying the rest of the pack
+    d = zlib.decompressobj()
+    chunks = []
+    window = size + 64
+    while not d.eof:
+        chunk = buf[pos : pos + window]
+        assert chunk, "truncated pack object"
+        chunks.append(d.decompress(chunk))
+        pos += len(chunk)
+        window = 65536
+    raw = b"".join(chunks)
+    assert len(raw) == size
+    return raw, pos - len(d.unused_data)
 
 
 if __name__ == "__main__":